@@ -1,27 +1,34 @@
 from dbclass.sqlite import SQLiteDB
 from dbclass.pgsql import PostgresDB
 from dbclass.duck import DuckDB
+import logging
 import os
+from contextlib import nullcontext
+from itertools import islice
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
 class DatabaseManager:
     def is_db_available(self):
         """
         检查数据库实例是否可用
         """
         if not hasattr(self, 'db') or not self.db:
-            print("数据库实例不可用，请检查数据库连接配置.")
+            log.warning("数据库实例不可用，请检查数据库连接配置.")
             return False
         return True
     def __init__(self, db_type='sqlite', **kwargs):
         if db_type == 'sqlite':
             db_file = kwargs.get('db_file', 'sqlite.db')
             if not os.path.exists(db_file):
-                print(f"配置文件 '{db_file}' 不存在，请检查配置路径.")
+                log.warning("配置文件 '%s' 不存在，请检查配置路径.", db_file)
                 raise FileNotFoundError(f"配置文件 '{db_file}' 不存在，请检查配置路径.")
             self.db = SQLiteDB(db_file)
         elif db_type == 'postgres':
             config_file = kwargs.get('config_file', 'config.toml')
             if not os.path.exists(config_file):
-                print(f"配置文件 '{config_file}' 不存在，请检查配置路径.")
+                log.warning("配置文件 '%s' 不存在，请检查配置路径.", config_file)
                 raise FileNotFoundError(f"配置文件 '{config_file}' 不存在，请检查配置路径.")
             self.db = PostgresDB(config_file=config_file)
         elif db_type == 'duckdb':
@@ -29,9 +36,45 @@ class DatabaseManager:
             self.db = DuckDB(db_file=db_file)
         else:
             raise ValueError("不支持的数据库类型. 必须是 'sqlite', 'postgres' 或 'duckdb'.")
-    def upsert(self, table_name, data):
+    def upsert(self, table_name, data, batch=False, primary_key=None):
+        """
+        插入或更新数据
+        :param batch: 为 True 时 data 为字典列表，在一个事务中批量写入
+        :param primary_key: batch 为 True 且表不存在时用作主键的列
+        """
         if self.is_db_available():
-            self.db.upsert(table_name, data)
+            if batch:
+                self.upsert_many(table_name, data, primary_key=primary_key)
+            else:
+                self.db.upsert(table_name, data)
+
+    def upsert_many(self, table_name, rows, batch_size=1000, primary_key=None):
+        """
+        流式批量插入或更新字典数据：每 batch_size 行组成一个以主键为索引的 DataFrame，
+        经 upsert_from_dataframe 写入，所有批次在同一个事务中提交
+        :param table_name: 表名
+        :param rows: 字典的可迭代对象，可以是生成器
+        :param batch_size: 每批行数
+        :param primary_key: 表不存在时用作主键的列名或列名列表，表已存在时使用表的主键
+        """
+        if not self.is_db_available():
+            return
+
+        primary_key_columns = self.db.get_primary_key(table_name)
+        if not primary_key_columns:
+            primary_key_columns = [primary_key] if isinstance(primary_key, str) else list(primary_key or [])
+        if not primary_key_columns:
+            log.warning("表 %s 不存在或没有主键，且未指定 primary_key，无法批量写入.", table_name)
+            return
+
+        rows = iter(rows)
+        # 外层已开启事务时直接加入，否则所有批次共用一个新事务
+        with nullcontext() if self.db._in_transaction else self.db:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                self.db.upsert_from_dataframe(table_name, pd.DataFrame(batch).set_index(primary_key_columns))
 
     def query(self, query, return_type='pandas'):
         if self.is_db_available():
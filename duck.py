@@ -1,22 +1,63 @@
 import duckdb
+import logging
 import os
-import pickle
-import sys
-import subprocess
-os.environ['HTTP_PROXY'] = 'http://127.0.0.1:10808'
-os.environ['HTTP_PROXY'] = 'http://127.0.0.1:10808'
-# 检查并升级 pandas
+import re
+from contextlib import contextmanager
+from functools import lru_cache
+import pandas as pd
+
+if tuple(int(part) for part in pd.__version__.split('.')[:2]) < (1, 1):
+    raise ImportError(f"需要 pandas>=1.1.5，当前版本为 {pd.__version__}，请先升级 pandas.")
+
+from dbclass.metastore import MetaStore
+
 try:
-    import pandas
-    current_version = tuple(map(int, pandas.__version__.split('.')))
-    if current_version < (1, 1, 5):
-        subprocess.check_call([sys.executable, '-m', 'pip', 'install', '--upgrade', 'pandas'])
-        import pandas as pd
-    else:
-        import pandas as pd
-except ImportError:
-    subprocess.check_call([sys.executable, '-m', 'pip', 'install', 'pandas'])
-    import pandas as pd
+    import pyarrow as pa
+except ImportError:  # 未安装 pyarrow 时直接注册 DataFrame
+    pa = None
+
+log = logging.getLogger(__name__)
+
+# 可能改变表结构的命令，execute() 执行后清空全部表元数据缓存
+SCHEMA_CHANGE_PATTERN = re.compile(r'\b(CREATE|DROP|ALTER)\b', re.I)
+
+
+@lru_cache(maxsize=None)
+def _quote_ident(name):
+    """
+    将表名或列名加上双引号作为 SQL 标识符，内部的双引号转义，结果按名称缓存
+    :param name: 表名或列名
+    :return: 加引号后的标识符
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+# pandas dtype 到列类型的映射，未列出的类型按 VARCHAR 处理
+DUCK_TYPES = {
+    'int64': 'BIGINT',
+    'int32': 'INTEGER',
+    'int16': 'SMALLINT',
+    'int8': 'SMALLINT',
+    'uint32': 'BIGINT',
+    'uint16': 'INTEGER',
+    'uint8': 'SMALLINT',
+    'Int64': 'BIGINT',
+    'Int32': 'INTEGER',
+    'Int16': 'SMALLINT',
+    'Int8': 'SMALLINT',
+    'UInt32': 'BIGINT',
+    'UInt16': 'INTEGER',
+    'UInt8': 'SMALLINT',
+    'float64': 'DOUBLE',
+    'float32': 'FLOAT',
+    'Float64': 'DOUBLE',
+    'Float32': 'FLOAT',
+    'bool': 'BOOLEAN',
+    'boolean': 'BOOLEAN',
+    'datetime64[s]': 'TIMESTAMP',
+    'datetime64[ms]': 'TIMESTAMP',
+    'datetime64[us]': 'TIMESTAMP',
+    'datetime64[ns]': 'TIMESTAMP',
+}
 
 class DuckDB:
     def __init__(self, db_file=':memory:'):
@@ -25,73 +66,137 @@ class DuckDB:
         :param db_file: 数据库文件名，默认为内存数据库。如果指定文件名，则保存到本地。
         """
         try:
-            self.cache_file = 'db_cache.pkl'
+            self.cache_file = 'db_cache.sqlite'
+            if db_file == ':memory:':
+                # 内存数据库的表随连接消失，元数据也不落盘
+                self.meta = MetaStore(db_file, cache_file=':memory:')
+            else:
+                self.meta = MetaStore(os.path.abspath(db_file), cache_file=self.cache_file)
             self.cache = self._load_cache()
+            self._stmt_cache = {}
+            self._in_transaction = False
+            # 当前事务中获得元数据的表
+            self._txn_tables = set()
             self.connection = duckdb.connect(database=db_file)
             self.cursor = self.connection.cursor()
-        except Exception as e:
-            print(f"DuckDB 数据库连接失败: {e}")
-            return
-
-        # 加载缓存
-
+            self._prime_primary_keys()
+        except Exception:
+            log.exception("DuckDB 数据库连接失败")
+            # 关闭已经打开的资源后抛出，避免文件句柄泄漏
+            for resource in ('cursor', 'connection', 'meta'):
+                if getattr(self, resource, None) is not None:
+                    getattr(self, resource).close()
+            raise
 
     def is_db_available(self):
         """
         检查数据库实例是否可用
         """
         if not hasattr(self, 'connection') or not self.connection:
-            print("数据库实例不可用，请检查数据库连接配置.")
+            log.warning("数据库实例不可用，请检查数据库连接配置.")
             return False
         return True
     def _load_cache(self):
         """
         从本地加载缓存
         """
-        if os.path.exists(self.cache_file):
-            with open(self.cache_file, 'rb') as f:
-                return pickle.load(f)
-        return {}
-
-    def _save_cache(self):
-        """
-        保存缓存到本地
-        """
-        with open(self.cache_file, 'wb') as f:
-            pickle.dump(self.cache, f)
+        return self.meta.load()
 
     def clear_cache(self):
         """
         清空缓存
         """
         self.cache = {}
-        self._save_cache()
-        print("缓存已清空")
+        self.meta.clear()
+        self._stmt_cache.clear()
+        log.info("缓存已清空")
 
-    def _get_primary_key(self, table_name):
+    def _prime_primary_keys(self):
         """
-        获取指定表的主键列名，使用缓存
+        连接时一次性查询当前模式下所有表的主键，整体替换本地缓存中的主键信息，已删除的表随之移除
+        """
+        rows = self.cursor.execute(
+            "SELECT table_name, constraint_column_names FROM duckdb_constraints() "
+            "WHERE constraint_type = 'PRIMARY KEY' "
+            "AND database_name = current_database() AND schema_name = current_schema()"
+        ).fetchall()
+        primary_keys = {table_name: list(columns) for table_name, columns in rows}
+        for table_name in list(self.cache):
+            self.cache[table_name].pop('primary_key', None)
+            if not self.cache[table_name]:
+                del self.cache[table_name]
+        for table_name, columns in primary_keys.items():
+            self.cache.setdefault(table_name, {})['primary_key'] = columns
+        self.meta.replace_many('primary_key', primary_keys)
+
+    def _get_table_meta(self, table_name):
+        """
+        获取指定表的主键列名，使用缓存；表不存在的结果也会缓存，建表后失效
         :param table_name: 表名
-        :return: 主键列名
+        :return: 主键列名；表存在但无主键时为空列表，表不存在时为 None
         """
         if table_name in self.cache and 'primary_key' in self.cache[table_name]:
             return self.cache[table_name]['primary_key']
 
-        conflict_column_query = f"PRAGMA table_info('{table_name}');"""
+        # 表名作为参数绑定，语句文本固定，不同表共用同一条查询
+        table_meta_query = (
+            "SELECT EXISTS (SELECT 1 FROM duckdb_tables() WHERE lower(table_name) = lower($1) "
+            "AND database_name = current_database() AND schema_name = current_schema()), "
+            "(SELECT constraint_column_names FROM duckdb_constraints() WHERE lower(table_name) = lower($1) "
+            "AND database_name = current_database() AND schema_name = current_schema() "
+            "AND constraint_type = 'PRIMARY KEY' LIMIT 1);"
+        )
 
         try:
-            self.cursor.execute(conflict_column_query)
-            rows = self.cursor.fetchall()
-            conflict_columns = [row[1] for row in rows if row[5] == 1]
-            # 缓存主键信息
-            if table_name not in self.cache:
-                self.cache[table_name] = {}
-            self.cache[table_name]['primary_key'] = conflict_columns
-            self._save_cache()
-            return conflict_columns
-        except Exception as e:
-            print(f"无法确定主键列: {e}")
+            exists, primary_key = self.cursor.execute(table_meta_query, [table_name]).fetchone()
+        except Exception:
+            log.exception("无法确定主键列")
+            return None
+
+        if not exists:
+            # 表不存在，只在内存中记录，不写入本地缓存
+            self._cache_table_meta(table_name, 'primary_key', None)
             return None
+        conflict_columns = list(primary_key or [])
+
+        # 缓存主键信息
+        self._cache_table_meta(table_name, 'primary_key', conflict_columns)
+        return conflict_columns
+
+    def _cache_table_meta(self, table_name, kind, value):
+        """
+        写入表元数据缓存；事务中获得的元数据可能随回滚失效，先只记在内存中，提交后才落盘
+        :param table_name: 表名
+        :param kind: 元数据种类
+        :param value: 元数据，表不存在时为 None，不落盘
+        """
+        self.cache.setdefault(table_name, {})[kind] = value
+        if self._in_transaction:
+            self._txn_tables.add(table_name)
+        elif value is not None:
+            self.meta.save(table_name, kind, value)
+
+    def _settle_table_meta(self, committed):
+        """
+        事务结束时处理事务中获得的表元数据：提交则落盘，回滚则从缓存中丢弃
+        :param committed: 事务是否已提交
+        """
+        tables, self._txn_tables = self._txn_tables, set()
+        for table_name in tables:
+            if committed:
+                for kind, value in self.cache.get(table_name, {}).items():
+                    if value is not None:
+                        self.meta.save(table_name, kind, value)
+            else:
+                self.cache.pop(table_name, None)
+
+    def get_primary_key(self, table_name):
+        """
+        获取指定表的主键列名，使用缓存
+        :param table_name: 表名
+        :return: 主键列名；表不存在时为 None
+        """
+        return self._get_table_meta(table_name)
 
     def _create_table_from_dataframe(self, table_name, df):
         """
@@ -99,33 +204,31 @@ class DuckDB:
         :param table_name: 表名
         :param df: pandas DataFrame，用于定义表的结构
         """
-        columns_with_types = []
-        for column in df.columns:
-            dtype = df[column].dtype
-            if dtype == 'int64':
-                columns_with_types.append(f"{column} INTEGER")
-            elif dtype == 'float64':
-                columns_with_types.append(f"{column} DOUBLE")
-            else:
-                columns_with_types.append(f"{column} VARCHAR")
+        types = df.dtypes.map(lambda dtype: DUCK_TYPES.get(str(dtype), 'VARCHAR'))
+        columns_with_types = [f"{_quote_ident(column)} {sql_type}" for column, sql_type in types.items()]
 
         # 使用 DataFrame 的索引作为主键，可能是多字段主键
         primary_keys = [pk for pk in df.index.names if pk is not None]
         if not primary_keys:
-            print("无索引，创建表失败.")
+            log.warning("无索引，创建表失败.")
             return
 
-        primary_keys_str = ', '.join(primary_keys)
+        primary_keys_str = ', '.join(map(_quote_ident, primary_keys))
         for pk in primary_keys:
             if pk not in df.columns:
-                columns_with_types.append(f"{pk} VARCHAR")
+                columns_with_types.append(f"{_quote_ident(pk)} VARCHAR")
 
-        create_table_query = f"CREATE TABLE {table_name} ({', '.join(columns_with_types)}, PRIMARY KEY ({primary_keys_str}));"
+        create_table_query = f"CREATE TABLE {_quote_ident(table_name)} ({', '.join(columns_with_types)}, PRIMARY KEY ({primary_keys_str}));"
         try:
             self.cursor.execute(create_table_query)
-            print(f"表 '{table_name}' 创建成功.")
-        except Exception as e:
-            print(f"创建表 '{table_name}' 失败: {e}")
+            log.info("表 '%s' 创建成功.", table_name)
+        except Exception:
+            log.exception("创建表 '%s' 失败", table_name)
+            if self._in_transaction:
+                raise
+        finally:
+            # 建表后主键缓存失效，下次查询时重新获取
+            self.cache.get(table_name, {}).pop('primary_key', None)
 
     def upsert_from_dataframe(self, table_name, df):
         """
@@ -134,32 +237,52 @@ class DuckDB:
         :param df: pandas DataFrame，包含要插入的数据
         """
         if df.empty:
-            print("未提供任何要插入的数据.")
+            log.warning("未提供任何要插入的数据.")
             return
 
-        # 检查表是否存在，不存在则创建
-        if not self._get_primary_key(table_name):
+        # 获取主键列名，表不存在则创建
+        conflict_columns = self._get_table_meta(table_name)
+        if conflict_columns is None:
             self._create_table_from_dataframe(table_name, df)
-
-        columns = df.reset_index().columns.tolist()
-        values_list = df.reset_index().values.tolist()
-
-        # 获取主键列名
-        conflict_columns = self._get_primary_key(table_name)
+            conflict_columns = self._get_table_meta(table_name)
         if not conflict_columns:
             return
 
-        # 构建 SQL 批量插入语句，遇到冲突时更新
-        placeholders = ', '.join('?' * len(columns))
-        update_fields = ', '.join([f"{col}=excluded.{col}" for col in columns if col not in conflict_columns])
-        insert_statement = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders}) ON CONFLICT ({', '.join(conflict_columns)}) DO UPDATE SET {update_fields};"
+        tmp = df.reset_index()
+        columns = tmp.columns.tolist()
+
+        # 注册 DataFrame 为临时视图，DuckDB 直接扫描其列数据，整批 INSERT ... SELECT，遇到冲突时更新；按 (表名, 列) 缓存
+        key = ('dataframe', table_name, tuple(columns))
+        insert_statement = self._stmt_cache.get(key)
+        if insert_statement is None:
+            table = _quote_ident(table_name)
+            fields = ', '.join(map(_quote_ident, columns))
+            conflict_fields = ', '.join(map(_quote_ident, conflict_columns))
+            update_columns = [_quote_ident(col) for col in columns if col not in conflict_columns]
+            # 只有主键列时没有可更新的列，冲突时直接跳过
+            action = f"DO UPDATE SET {', '.join([f'{col}=excluded.{col}' for col in update_columns])}" if update_columns else "DO NOTHING"
+            insert_statement = f"INSERT INTO {table} ({fields}) SELECT {fields} FROM __upsert_tmp ON CONFLICT ({conflict_fields}) {action};"
+            self._stmt_cache[key] = insert_statement
+
+        # 先转换为 Arrow 表再注册，DuckDB 直接读取列缓冲区，字符串列不再逐个经过 Python 对象
+        source = tmp
+        if pa is not None:
+            try:
+                source = pa.Table.from_pandas(tmp, preserve_index=False)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # 混合类型的 object 列无法转换时退回直接注册 DataFrame
+                pass
 
         try:
-            self.cursor.executemany(insert_statement, values_list)
-            self.connection.commit()
-            print(f"批量数据已插入到表 {table_name}")
-        except Exception as e:
-            print(f"批量插入数据到表 {table_name} 失败: {e}")
+            self.cursor.register('__upsert_tmp', source)
+            self.cursor.execute(insert_statement)
+            log.debug("批量数据已插入到表 %s", table_name)
+        except Exception:
+            log.exception("批量插入数据到表 %s 失败", table_name)
+            if self._in_transaction:
+                raise
+        finally:
+            self.cursor.unregister('__upsert_tmp')
 
     def upsert_from_dict(self, table_name, data):
         """
@@ -168,33 +291,119 @@ class DuckDB:
         :param data: 字典，包含要插入的数据 {'column1': value1, 'column2': value2, ...}
         """
         if not data:
-            print("未提供任何要插入的数据.")
+            log.warning("未提供任何要插入的数据.")
             return
 
         columns = list(data.keys())
         values = [data[column] for column in columns]
 
-        # 检查表是否存在，不存在则创建
-        df = pd.DataFrame([data])
-        if not self._get_primary_key(table_name):
-            self._create_table_from_dataframe(table_name, df)
-
-        # 获取主键列名
-        conflict_columns = self._get_primary_key(table_name)
+        # 获取主键列名，表不存在则创建
+        conflict_columns = self._get_table_meta(table_name)
+        if conflict_columns is None:
+            self._create_table_from_dataframe(table_name, pd.DataFrame([data]))
+            conflict_columns = self._get_table_meta(table_name)
         if not conflict_columns:
             return
 
-        # 构建 SQL 插入语句，遇到冲突时更新
-        placeholders = ', '.join('?' * len(columns))
-        update_fields = ', '.join([f"{col}=excluded.{col}" for col in columns if col not in conflict_columns])
-        insert_statement = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders}) ON CONFLICT ({', '.join(conflict_columns)}) DO UPDATE SET {update_fields};"
+        insert_statement = self._dict_insert_statement(table_name, columns, conflict_columns)
 
         try:
             self.cursor.execute(insert_statement, values)
-            self.connection.commit()
-            print(f"数据已插入到表 {table_name}")
-        except Exception as e:
-            print(f"插入数据到表 {table_name} 失败: {e}")
+            log.debug("数据已插入到表 %s", table_name)
+        except Exception:
+            log.exception("插入数据到表 %s 失败", table_name)
+            if self._in_transaction:
+                raise
+
+    def _dict_insert_statement(self, table_name, columns, conflict_columns):
+        """
+        获取单行 upsert 语句，按 (表名, 列) 缓存
+        :param table_name: 表名
+        :param columns: 插入的列
+        :param conflict_columns: 主键列
+        :return: 参数占位符为 ? 的 SQL 语句
+        """
+        key = ('dict', table_name, tuple(columns))
+        insert_statement = self._stmt_cache.get(key)
+        if insert_statement is None:
+            # 构建 SQL 插入语句，遇到冲突时更新
+            placeholders = ', '.join('?' * len(columns))
+            fields = ', '.join(map(_quote_ident, columns))
+            conflict_fields = ', '.join(map(_quote_ident, conflict_columns))
+            update_columns = [_quote_ident(col) for col in columns if col not in conflict_columns]
+            # 只有主键列时没有可更新的列，冲突时直接跳过
+            action = f"DO UPDATE SET {', '.join([f'{col}=excluded.{col}' for col in update_columns])}" if update_columns else "DO NOTHING"
+            insert_statement = f"INSERT INTO {_quote_ident(table_name)} ({fields}) VALUES ({placeholders}) ON CONFLICT ({conflict_fields}) {action};"
+            self._stmt_cache[key] = insert_statement
+        return insert_statement
+
+    def upsert_many(self, table_name, rows):
+        """
+        在一个事务中批量插入多条字典数据，如果主键冲突则更新
+        :param table_name: 表名
+        :param rows: 字典列表，各字典的键需与第一条一致
+        """
+        rows = list(rows)
+        if not rows:
+            log.warning("未提供任何要插入的数据.")
+            return
+
+        columns = list(rows[0].keys())
+
+        # 获取主键列名，表不存在则创建
+        conflict_columns = self._get_table_meta(table_name)
+        if conflict_columns is None:
+            self._create_table_from_dataframe(table_name, pd.DataFrame([rows[0]]))
+            conflict_columns = self._get_table_meta(table_name)
+        if not conflict_columns:
+            return
+
+        insert_statement = self._dict_insert_statement(table_name, columns, conflict_columns)
+        values_list = [[row[column] for column in columns] for row in rows]
+
+        try:
+            with self._transaction():
+                self.cursor.executemany(insert_statement, values_list)
+            log.debug("批量数据已插入到表 %s", table_name)
+        except Exception:
+            log.exception("批量插入数据到表 %s 失败", table_name)
+            if self._in_transaction:
+                raise
+
+    @contextmanager
+    def _transaction(self):
+        """
+        在事务中执行；已处于 with 块开启的事务中时直接复用
+        """
+        if self._in_transaction:
+            yield
+            return
+        self.cursor.execute('BEGIN TRANSACTION')
+        try:
+            yield
+        except Exception:
+            self.cursor.execute('ROLLBACK')
+            raise
+        self.cursor.execute('COMMIT')
+
+    def __enter__(self):
+        """
+        开启事务，with 块内的写入在退出时一并提交；
+        块内的写入失败会抛出异常，整个事务回滚
+        """
+        self.cursor.execute('BEGIN TRANSACTION')
+        self._in_transaction = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._in_transaction = False
+        try:
+            self.cursor.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+            self._settle_table_meta(exc_type is None)
+        except Exception:
+            self._settle_table_meta(False)
+            raise
+        return False
 
     def upsert(self, table_name, data):
         """
@@ -207,7 +416,7 @@ class DuckDB:
         elif isinstance(data, dict):
             self.upsert_from_dict(table_name, data)
         else:
-            print("不支持的 upsert 数据类型. 必须是字典或 pandas DataFrame.")
+            log.warning("不支持的 upsert 数据类型. 必须是字典或 pandas DataFrame.")
 
     def execute(self, command):
         """
@@ -216,9 +425,27 @@ class DuckDB:
         """
         try:
             self.cursor.execute(command)
-            print(f"命令 '{command}' 执行成功.")
-        except Exception as e:
-            print(f"命令 '{command}' 执行失败: {e}")
+        except Exception:
+            log.exception("命令 '%s' 执行失败", command)
+            if self._in_transaction:
+                raise
+        finally:
+            self._forget_table_meta(command)
+
+    def _forget_table_meta(self, command):
+        """
+        execute() 之后使表元数据缓存失效，下次写入时重新查询：建表、删表、改表后清空全部缓存，
+        其他命令（如 SELECT ... INTO）也可能新建表，丢弃“表不存在”的记录
+        :param command: 已执行的命令
+        """
+        if SCHEMA_CHANGE_PATTERN.search(command):
+            self.cache = {}
+            self._stmt_cache.clear()
+            return
+        for meta in self.cache.values():
+            if 'primary_key' in meta and meta['primary_key'] is None:
+                del meta['primary_key']
+
     def query(self, query, return_type='pandas'):
         """
         查询数据并返回 pandas DataFrame 或字典格式
@@ -227,18 +454,18 @@ class DuckDB:
         :return: pandas DataFrame 或 字典
         """
         try:
-            self.cursor.execute(query)
-            columns = [desc[0] for desc in self.cursor.description]
-            rows = self.cursor.fetchall()
+            result = self.cursor.execute(query)
 
             if return_type == 'pandas':
-                return pd.DataFrame(rows, columns=columns)
+                # 按列直接导出为 DataFrame，不经过逐行的 Python 元组
+                return result.df()
             elif return_type == 'dict':
-                return [dict(zip(columns, row)) for row in rows]
+                columns = [desc[0] for desc in result.description]
+                return [dict(zip(columns, row)) for row in result.fetchall()]
             else:
                 raise ValueError("无效的返回类型. 使用 'pandas' 或 'dict'.")
-        except Exception as e:
-            print(f"查询失败: {e}")
+        except Exception:
+            log.exception("查询失败")
             return None
 
     def close(self):
@@ -247,7 +474,8 @@ class DuckDB:
         """
         self.cursor.close()
         self.connection.close()
-        print("数据库连接已关闭")
+        self.meta.close()
+        log.debug("数据库连接已关闭")
 
 # 示例使用
 if __name__ == "__main__":
@@ -0,0 +1,79 @@
+import json
+import sqlite3
+import threading
+
+
+class MetaStore:
+    def __init__(self, db_key, cache_file='db_cache.sqlite'):
+        """
+        表元数据（主键、非空列等）的本地缓存，按行存放在 SQLite 文件中，逐条读写
+        :param db_key: 数据库标识，区分不同数据库中的同名表
+        :param cache_file: 缓存文件名，':memory:' 表示不落盘
+        """
+        self.db_key = db_key
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(cache_file, isolation_level=None, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            "db_key TEXT, table_name TEXT, kind TEXT, value TEXT, "
+            "PRIMARY KEY (db_key, table_name, kind))"
+        )
+
+    def load(self):
+        """
+        读取当前数据库的全部元数据
+        :return: {表名: {类型: 值}}
+        """
+        cache = {}
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT table_name, kind, value FROM metadata WHERE db_key = ?", (self.db_key,)
+            ).fetchall()
+        for table_name, kind, value in rows:
+            cache.setdefault(table_name, {})[kind] = json.loads(value)
+        return cache
+
+    def save(self, table_name, kind, value):
+        """
+        写入单条元数据
+        :param table_name: 表名
+        :param kind: 元数据类型，如 'primary_key'
+        :param value: 可 JSON 序列化的值
+        """
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO metadata (db_key, table_name, kind, value) VALUES (?, ?, ?, ?)",
+                (self.db_key, table_name, kind, json.dumps(value))
+            )
+
+    def replace_many(self, kind, values):
+        """
+        用 values 整体替换同一类型的元数据，values 中没有的表的该类元数据被删除
+        :param kind: 元数据类型，如 'primary_key'
+        :param values: {表名: 值}
+        """
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.execute("DELETE FROM metadata WHERE db_key = ? AND kind = ?", (self.db_key, kind))
+                self.connection.executemany(
+                    "INSERT INTO metadata (db_key, table_name, kind, value) VALUES (?, ?, ?, ?)",
+                    [(self.db_key, table_name, kind, json.dumps(value)) for table_name, value in values.items()]
+                )
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def clear(self):
+        """
+        清空当前数据库的元数据
+        """
+        with self.lock:
+            self.connection.execute("DELETE FROM metadata WHERE db_key = ?", (self.db_key,))
+
+    def close(self):
+        """
+        关闭缓存文件
+        """
+        self.connection.close()
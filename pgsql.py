@@ -1,13 +1,78 @@
+import io
+import logging
+import os
+import re
+import hashlib
+import threading
+import weakref
+from contextlib import contextmanager
 import psycopg2
 import pandas as pd
 from psycopg2 import sql
 import psycopg2.extras
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 import toml
-import os
-import pickle
 import redis
+from dbclass.metastore import MetaStore
+
+log = logging.getLogger(__name__)
+
+# 可能改变表结构的命令，execute() 执行后清空全部表元数据缓存
+SCHEMA_CHANGE_PATTERN = re.compile(r'\b(CREATE|DROP|ALTER)\b', re.I)
+
+# pandas dtype 到列类型的映射，未列出的类型按 TEXT 处理
+PG_TYPES = {
+    'int64': 'BIGINT',
+    'int32': 'INTEGER',
+    'int16': 'SMALLINT',
+    'int8': 'SMALLINT',
+    'uint32': 'BIGINT',
+    'uint16': 'INTEGER',
+    'uint8': 'SMALLINT',
+    'Int64': 'BIGINT',
+    'Int32': 'INTEGER',
+    'Int16': 'SMALLINT',
+    'Int8': 'SMALLINT',
+    'UInt32': 'BIGINT',
+    'UInt16': 'INTEGER',
+    'UInt8': 'SMALLINT',
+    'float64': 'FLOAT',
+    'float32': 'REAL',
+    'Float64': 'FLOAT',
+    'Float32': 'REAL',
+    'bool': 'BOOLEAN',
+    'boolean': 'BOOLEAN',
+    'datetime64[s]': 'TIMESTAMP',
+    'datetime64[ms]': 'TIMESTAMP',
+    'datetime64[us]': 'TIMESTAMP',
+    'datetime64[ns]': 'TIMESTAMP',
+}
+
+# COPY 每次写入的行数，控制客户端 CSV 缓冲区的内存占用
+COPY_CHUNK_ROWS = 100000
+# 查询时服务端游标每批取回的行数
+FETCH_CHUNK_ROWS = 50000
+
+
+def _has_binary_values(df):
+    """
+    检查 object 列中是否有二进制值；to_csv 会把 bytes 写成 "b'...'"，服务端仍当作合法的 bytea 接受
+    :param df: pandas DataFrame
+    :return: 是否含有 bytes、bytearray 或 memoryview
+    """
+    binary_types = (bytes, bytearray, memoryview)
+    return any(
+        any(isinstance(value, binary_types) for value in df[column])
+        for column in df.columns if df[column].dtype == object
+    )
 
 class PostgresDB:
+    # 按配置文件共享的连接池，同一进程内的实例复用连接
+    _pools = {}
+    _pools_lock = threading.Lock()
+    # 每个连接上已 PREPARE 的语句名，连接被关闭回收后条目自动消失
+    _prepared = weakref.WeakKeyDictionary()
+
     def __init__(self, config_file='config.toml'):
         """
         初始化数据库连接，并加载配置文件
@@ -17,24 +82,54 @@ class PostgresDB:
             config = toml.load(config_file)
             db_config = config['database']
             self.redis_config = config.get('redis', None)
+            # 是否使用 COPY 批量写入，连接池/代理不支持 COPY 时可在配置中关闭
+            self.use_copy = db_config.get('use_copy', True)
 
-            # 初始化 PostgreSQL 连接
-            self.connection = psycopg2.connect(
+            connect_params = dict(
                 host=db_config['host'],
                 database=db_config['database'],
                 user=db_config['user'],
                 password=db_config['password'],
                 port=db_config.get('port', 5432)
             )
-            self.connection.autocommit = True  # 自动提交事务
-            self.cursor = self.connection.cursor()
-        except Exception as e:
-            print(f"数据库连接失败: {e}")
-            return
-
-        # 加载缓存
-        self.cache_file = 'db_cache.pkl'
-        self.cache = self._load_cache()
+            # 连接池耗尽时等待归还的秒数，未配置时一直等待
+            self.pool_timeout = db_config.get('pool_timeout')
+
+            # 初始化 PostgreSQL 连接池，同一配置文件只建一次；信号量限制同时取出的连接数，
+            # 池满时 getconn 等待而不是直接抛出 PoolError
+            pool_key = os.path.abspath(config_file)
+            with PostgresDB._pools_lock:
+                if pool_key not in PostgresDB._pools:
+                    maxconn = db_config.get('pool_maxconn', 16)
+                    PostgresDB._pools[pool_key] = (
+                        ThreadedConnectionPool(db_config.get('pool_minconn', 1), maxconn, **connect_params),
+                        threading.BoundedSemaphore(maxconn)
+                    )
+                self._pool, self._pool_slots = PostgresDB._pools[pool_key]
+
+            self._local = threading.local()
+
+            # 兼容旧接口的 self.connection / self.cursor 使用池外的独立连接，首次访问时才建立
+            self._connect_params = connect_params
+            self._compat_connection = None
+            self._compat_cursor = None
+            self._compat_lock = threading.Lock()
+
+            # 加载缓存
+            self.cache_file = 'db_cache.sqlite'
+            self.meta = MetaStore(
+                f"postgres://{db_config['host']}:{db_config.get('port', 5432)}/{db_config['database']}",
+                cache_file=self.cache_file
+            )
+            self.cache = self._load_cache()
+            self._prime_primary_keys()
+            self._stmt_cache = {}
+        except Exception:
+            log.exception("数据库连接失败")
+            # 关闭已经打开的资源并归还连接后抛出，避免占用连接和文件句柄
+            if getattr(self, 'meta', None) is not None:
+                self.meta.close()
+            raise
 
         # 初始化 Redis 连接
         self.redis_client = None
@@ -49,66 +144,275 @@ class PostgresDB:
                 )
                 # 测试 Redis 连接
                 self.redis_client.ping()
-            except Exception as e:
-                print(f"Redis 连接失败: {e}")
+            except Exception:
+                log.exception("Redis 连接失败")
 
-    def _load_cache(self):
+    @property
+    def connection(self):
         """
-        从本地加载缓存
+        兼容旧接口的独立连接，不占用连接池，自动提交；首次访问时建立
+        """
+        with self._compat_lock:
+            if self._compat_connection is None:
+                self._compat_connection = psycopg2.connect(**self._connect_params)
+                self._compat_connection.autocommit = True  # 自动提交事务
+            return self._compat_connection
+
+    @property
+    def cursor(self):
         """
-        if os.path.exists(self.cache_file):
-            with open(self.cache_file, 'rb') as f:
-                return pickle.load(f)
-        return {}
+        兼容旧接口的游标，首次访问时随连接一起建立
+        """
+        connection = self.connection
+        with self._compat_lock:
+            if self._compat_cursor is None:
+                self._compat_cursor = connection.cursor()
+            return self._compat_cursor
 
-    def _save_cache(self):
+    def _getconn(self):
         """
-        保存缓存到本地
+        从连接池取出连接，池满时等待其他线程归还
         """
-        with open(self.cache_file, 'wb') as f:
-            pickle.dump(self.cache, f)
+        if not self._pool_slots.acquire(timeout=self.pool_timeout):
+            raise PoolError(f"连接池已耗尽，等待 {self.pool_timeout} 秒后仍无可用连接.")
+        try:
+            return self._pool.getconn()
+        except Exception:
+            self._pool_slots.release()
+            raise
+
+    def _putconn(self, connection):
+        """
+        将连接归还连接池，已断开的连接直接丢弃
+        """
+        try:
+            if connection.closed:
+                PostgresDB._prepared.pop(connection, None)
+            self._pool.putconn(connection, close=bool(connection.closed))
+        finally:
+            self._pool_slots.release()
+
+    @contextmanager
+    def _cursor(self):
+        """
+        从连接池取出一个自动提交的连接，用完后归还
+        """
+        # 处于 with 块开启的事务中时，复用该事务的连接
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            with connection.cursor() as cursor:
+                yield cursor
+            return
+
+        connection = self._getconn()
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                yield cursor
+        finally:
+            self._putconn(connection)
+
+    @contextmanager
+    def _server_cursor(self, cursor):
+        """
+        在 cursor 所在的连接上打开服务端游标；服务端游标只能在事务中使用，自动提交的连接临时切换为事务模式
+        :param cursor: 普通游标
+        """
+        connection = cursor.connection
+        autocommit = connection.autocommit
+        if autocommit:
+            connection.autocommit = False
+        try:
+            with connection.cursor(name='qmt_query') as stream:
+                stream.itersize = FETCH_CHUNK_ROWS
+                yield stream
+            if autocommit:
+                connection.commit()
+        except Exception:
+            if autocommit:
+                connection.rollback()
+            raise
+        finally:
+            if autocommit:
+                connection.autocommit = True
+
+    @contextmanager
+    def _transaction(self, cursor):
+        """
+        在事务中执行；连接已处于 with 块开启的事务中时直接复用
+        :param cursor: 执行语句使用的游标
+        """
+        if not cursor.connection.autocommit:
+            yield
+            return
+        # 连接为自动提交模式，显式开启事务
+        cursor.execute('BEGIN')
+        try:
+            yield
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+
+    @property
+    def _in_transaction(self):
+        """
+        当前线程是否处于 with 块开启的事务中
+        """
+        return getattr(self._local, 'connection', None) is not None
+
+    def __enter__(self):
+        """
+        开启事务，with 块内当前线程的写入共用同一连接，退出时提交；
+        块内的写入失败会抛出异常，整个事务回滚；不支持嵌套，与 DuckDB、SQLite 一致
+        """
+        if self._in_transaction:
+            raise psycopg2.ProgrammingError("当前线程已处于事务中，不能嵌套开启")
+        connection = self._getconn()
+        connection.autocommit = False
+        self._local.connection = connection
+        # 当前事务中获得元数据的表
+        self._local.txn_tables = set()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        connection = self._local.connection
+        self._local.connection = None
+        committed = False
+        try:
+            if exc_type is None:
+                connection.commit()
+                committed = True
+            else:
+                connection.rollback()
+        finally:
+            self._putconn(connection)
+            self._settle_table_meta(committed)
+        return False
+
+    def _load_cache(self):
+        """
+        从本地加载缓存
+        """
+        return self.meta.load()
 
     def clear_cache(self):
         """
         清空缓存
         """
         self.cache = {}
-        self._save_cache()
-        print("缓存已清空")
+        self.meta.clear()
+        self._stmt_cache.clear()
+        log.info("缓存已清空")
 
-    def _get_primary_key(self, table_name):
+    def _prime_primary_keys(self):
         """
-        获取指定表的主键列名，使用缓存
+        连接时一次性查询当前模式下所有表的主键，整体替换本地缓存中的主键信息，已删除的表随之移除
+        """
+        try:
+            with self._cursor() as cursor:
+                cursor.execute(
+                    "SELECT tc.table_name, kcu.column_name FROM information_schema.table_constraints tc "
+                    "JOIN information_schema.key_column_usage kcu "
+                    "ON kcu.constraint_schema = tc.constraint_schema AND kcu.constraint_name = tc.constraint_name "
+                    "AND kcu.table_name = tc.table_name "
+                    "WHERE tc.constraint_type = 'PRIMARY KEY' AND tc.table_schema = current_schema() "
+                    "ORDER BY tc.table_name, kcu.ordinal_position;"
+                )
+                primary_keys = {}
+                for table_name, column_name in cursor.fetchall():
+                    primary_keys.setdefault(table_name, []).append(column_name)
+        except Exception:
+            log.exception("无法预加载主键信息")
+            return
+
+        for table_name in list(self.cache):
+            self.cache[table_name].pop('primary_key', None)
+            if not self.cache[table_name]:
+                del self.cache[table_name]
+        for table_name, columns in primary_keys.items():
+            self.cache.setdefault(table_name, {})['primary_key'] = columns
+        self.meta.replace_many('primary_key', primary_keys)
+
+    def _get_table_meta(self, table_name, cursor):
+        """
+        获取指定表的主键列名，使用缓存；表不存在的结果也会缓存，建表后失效
         :param table_name: 表名
-        :return: 主键列名
+        :param cursor: 执行查询使用的游标
+        :return: 主键列名；表存在但无主键时为空列表，表不存在时为 None
         """
         if table_name in self.cache and 'primary_key' in self.cache[table_name]:
             return self.cache[table_name]['primary_key']
 
-        conflict_column_query = sql.SQL(
-            "SELECT kcu.column_name FROM information_schema.table_constraints tc "
+        # 一次查询同时得到表是否存在和主键列
+        table_meta_query = (
+            "SELECT to_regclass(quote_ident(current_schema()) || '.' || quote_ident(%(table)s)) IS NOT NULL, ARRAY("
+            "SELECT kcu.column_name::text FROM information_schema.table_constraints tc "
             "JOIN information_schema.key_column_usage kcu "
-            "ON kcu.constraint_name = tc.constraint_name "
-            "WHERE tc.table_name = {table} AND tc.constraint_type = 'PRIMARY KEY';"
-        ).format(table=sql.Literal(table_name))
+            "ON kcu.constraint_schema = tc.constraint_schema AND kcu.constraint_name = tc.constraint_name "
+            "AND kcu.table_name = tc.table_name "
+            "WHERE tc.table_name = %(table)s AND tc.table_schema = current_schema() "
+            "AND tc.constraint_type = 'PRIMARY KEY' "
+            "ORDER BY kcu.ordinal_position);"
+        )
 
         try:
-            self.cursor.execute(conflict_column_query)
-            conflict_columns = [row[0] for row in self.cursor.fetchall()]
-            # 缓存主键信息
-            if table_name not in self.cache:
-                self.cache[table_name] = {}
-            self.cache[table_name]['primary_key'] = conflict_columns
-            self._save_cache()
-            return conflict_columns
-        except Exception as e:
-            print(f"无法确定主键列: {e}")
+            cursor.execute(table_meta_query, {'table': table_name})
+            exists, conflict_columns = cursor.fetchone()
+        except Exception:
+            log.exception("无法确定主键列")
             return None
 
-    def _get_not_null_columns(self, table_name):
+        if not exists:
+            # 表不存在，只在内存中记录，不写入本地缓存
+            self._cache_table_meta(table_name, 'primary_key', None)
+            return None
+
+        # 缓存主键信息
+        self._cache_table_meta(table_name, 'primary_key', conflict_columns)
+        return conflict_columns
+
+    def _cache_table_meta(self, table_name, kind, value):
+        """
+        写入表元数据缓存；事务中获得的元数据可能随回滚失效，先只记在内存中，提交后才落盘
+        :param table_name: 表名
+        :param kind: 元数据种类
+        :param value: 元数据，表不存在时为 None，不落盘
+        """
+        self.cache.setdefault(table_name, {})[kind] = value
+        if self._in_transaction:
+            self._local.txn_tables.add(table_name)
+        elif value is not None:
+            self.meta.save(table_name, kind, value)
+
+    def _settle_table_meta(self, committed):
+        """
+        事务结束时处理事务中获得的表元数据：提交则落盘，回滚则从缓存中丢弃
+        :param committed: 事务是否已提交
+        """
+        tables, self._local.txn_tables = self._local.txn_tables, set()
+        for table_name in tables:
+            if committed:
+                for kind, value in self.cache.get(table_name, {}).items():
+                    if value is not None:
+                        self.meta.save(table_name, kind, value)
+            else:
+                self.cache.pop(table_name, None)
+
+    def get_primary_key(self, table_name):
+        """
+        获取指定表的主键列名，使用缓存
+        :param table_name: 表名
+        :return: 主键列名；表不存在时为 None
+        """
+        with self._cursor() as cursor:
+            return self._get_table_meta(table_name, cursor)
+
+    def _get_not_null_columns(self, table_name, cursor):
         """
         获取指定表中不能为空且没有默认值的列，使用缓存
         :param table_name: 表名
+        :param cursor: 执行查询使用的游标
         :return: 不能为空且没有默认值的列名列表
         """
         if table_name in self.cache and 'not_null_columns' in self.cache[table_name]:
@@ -120,34 +424,25 @@ class PostgresDB:
         ).format(table=sql.Literal(table_name))
 
         try:
-            self.cursor.execute(not_null_columns_query)
-            not_null_columns = [row[0] for row in self.cursor.fetchall()]
+            cursor.execute(not_null_columns_query)
+            not_null_columns = [row[0] for row in cursor.fetchall()]
             # 缓存非空字段信息
-            if table_name not in self.cache:
-                self.cache[table_name] = {}
-            self.cache[table_name]['not_null_columns'] = not_null_columns
-            self._save_cache()
+            self._cache_table_meta(table_name, 'not_null_columns', not_null_columns)
             return not_null_columns
-        except Exception as e:
-            print(f"无法确定非空且无默认值的列: {e}")
+        except Exception:
+            log.exception("无法确定非空且无默认值的列")
             return []
 
 
-    def _create_table_from_dataframe(self, table_name, df):
+    def _create_table_from_dataframe(self, table_name, df, cursor):
         """
         根据 DataFrame 创建新表
         :param table_name: 表名
         :param df: pandas DataFrame，用于定义表的结构
+        :param cursor: 执行建表语句使用的游标
         """
-        columns_with_types = []
-        for column in df.columns:
-            dtype = df[column].dtype
-            if dtype == 'int64':
-                columns_with_types.append(f"{column} INTEGER")
-            elif dtype == 'float64':
-                columns_with_types.append(f"{column} FLOAT")
-            else:
-                columns_with_types.append(f"{column} TEXT")
+        types = df.dtypes.map(lambda dtype: PG_TYPES.get(str(dtype), 'TEXT'))
+        columns_with_types = [f"{column} {sql_type}" for column, sql_type in types.items()]
 
         # 使用 DataFrame 的索引作为主键，可能是多字段主键
         primary_keys = [pk for pk in df.index.names if pk is not None]
@@ -156,7 +451,7 @@ class PostgresDB:
                 columns_with_types.append(f"{pk} TEXT")
 
         if not primary_keys:
-            print("无索引，创建表失败.")
+            log.warning("无索引，创建表失败.")
             return
 
         primary_keys_str = ', '.join(primary_keys)
@@ -167,10 +462,15 @@ class PostgresDB:
 
         create_table_query = f"CREATE TABLE {table_name} ({', '.join(columns_with_types)}, PRIMARY KEY ({primary_keys_str}));"
         try:
-            self.cursor.execute(create_table_query)
-            print(f"表 '{table_name}' 创建成功.")
-        except Exception as e:
-            print(f"创建表 '{table_name}' 失败: {e}")
+            cursor.execute(create_table_query)
+            log.info("表 '%s' 创建成功.", table_name)
+        except Exception:
+            log.exception("创建表 '%s' 失败", table_name)
+            if self._in_transaction:
+                raise
+        finally:
+            # 建表后主键缓存失效，下次查询时重新获取
+            self.cache.get(table_name, {}).pop('primary_key', None)
 
     def upsert_from_dataframe(self, table_name, df):
         """
@@ -179,39 +479,151 @@ class PostgresDB:
         :param df: pandas DataFrame，包含要插入的数据
         """
         if df.empty:
-            print("未提供任何要插入的数据.")
+            log.warning("未提供任何要插入的数据.")
             return
 
-        # 检查表是否存在，不存在则创建
-        if not self._get_primary_key(table_name):
-             self._create_table_from_dataframe(table_name, df)
+        with self._cursor() as cursor:
+            # 获取主键列名，表不存在则创建
+            conflict_columns = self._get_table_meta(table_name, cursor)
+            if conflict_columns is None:
+                self._create_table_from_dataframe(table_name, df, cursor)
+                conflict_columns = self._get_table_meta(table_name, cursor)
+            if not conflict_columns:
+                return
+
+            columns = df.columns.tolist()
+            reset = df.reset_index()
+
+            # 语句按 (表名, 列) 缓存，重复写入同一张表时不再重新拼装 SQL
+            key = ('dataframe', table_name, tuple(reset.columns))
+            statements = self._stmt_cache.get(key)
+            if statements is None:
+                statements = self._build_dataframe_statements(table_name, list(key[2]), columns, conflict_columns, cursor)
+                self._stmt_cache[key] = statements
 
-        columns = df.columns.tolist()
-        values_list = df.reset_index().values.tolist()
-
-        # 获取主键列名
-        conflict_columns = self._get_primary_key(table_name)
-        if not conflict_columns:
-            return
-
-        # 构建 SQL 批量插入语句，遇到冲突时更新
-        insert_statement = sql.SQL(
-            'INSERT INTO {table} ({fields}) VALUES %s ON CONFLICT ({conflict}) DO UPDATE SET {update_fields}'
-        ).format(
-            table=sql.Identifier(table_name),
-            fields=sql.SQL(',').join(map(sql.Identifier, df.reset_index().columns)),
-            conflict=sql.SQL(', ').join(map(sql.Identifier, conflict_columns)),
-            update_fields=sql.SQL(', ').join(
-                sql.Composed([sql.Identifier(col), sql.SQL(' = EXCLUDED.'), sql.Identifier(col)])
-                for col in columns if col not in conflict_columns
-            )
+            try:
+                # 含二进制值时 CSV 无法正确表示，直接用参数绑定写入
+                if self.use_copy and not _has_binary_values(reset):
+                    try:
+                        self._copy_upsert(reset, statements, cursor)
+                    except psycopg2.DataError:
+                        # CSV 文本无法转换为目标列类型（如含空值的整数列以 1.0 写出），改用参数绑定写入；
+                        # 与 COPY 一致，NaN 按 NULL 写入
+                        log.debug("COPY 写入表 %s 失败，改用 execute_values", table_name, exc_info=True)
+                        self._values_upsert(reset.astype(object).where(reset.notna(), None), statements, cursor)
+                else:
+                    self._values_upsert(reset, statements, cursor)
+                log.debug("批量数据已插入到表 %s", table_name)
+            except Exception:
+                log.exception("批量插入数据到表 %s 失败", table_name)
+                if self._in_transaction:
+                    raise
+
+    def _build_dataframe_statements(self, table_name, fields, columns, conflict_columns, cursor):
+        """
+        构建 DataFrame 批量写入所需的 SQL 语句
+        :param table_name: 表名
+        :param fields: 插入的列（包含索引列）
+        :param columns: 数据列
+        :param conflict_columns: 主键列
+        :param cursor: 用于转义标识符的游标
+        :return: {'create_staging', 'drop_staging', 'copy', 'insert_from_staging', 'values'} 对应的 SQL 字符串，以及 execute_values 的行模板 'values_template'
+        """
+        table = sql.Identifier(table_name)
+        staging = sql.Identifier(f"stg_{table_name}")
+        values_template = '(' + ','.join(['%s'] * len(fields)) + ')'
+        fields = sql.SQL(',').join(map(sql.Identifier, fields))
+        conflict = sql.SQL(', ').join(map(sql.Identifier, conflict_columns))
+        update_columns = [col for col in columns if col not in conflict_columns]
+        # 只有主键列时没有可更新的列，冲突时直接跳过
+        action = sql.SQL('DO UPDATE SET {}').format(sql.SQL(', ').join(
+            sql.Composed([sql.Identifier(col), sql.SQL(' = EXCLUDED.'), sql.Identifier(col)])
+            for col in update_columns
+        )) if update_columns else sql.SQL('DO NOTHING')
+
+        statements = {
+            'create_staging': sql.SQL(
+                'CREATE TEMP TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP'
+            ).format(staging=staging, table=table),
+            'drop_staging': sql.SQL('DROP TABLE {staging}').format(staging=staging),
+            # 空值写为 \N，与空字符串区分开
+            'copy': sql.SQL("COPY {staging} ({fields}) FROM STDIN WITH (FORMAT csv, NULL '\\N')").format(
+                staging=staging, fields=fields
+            ),
+            # 保留 ON CONFLICT 而不用 MERGE：并发写入同一主键时 MERGE 可能触发唯一约束冲突
+            'insert_from_staging': sql.SQL(
+                'INSERT INTO {table} ({fields}) SELECT {fields} FROM {staging} ON CONFLICT ({conflict}) {action}'
+            ).format(
+                table=table,
+                fields=fields,
+                staging=staging,
+                conflict=conflict,
+                action=action
+            ),
+            # 构建 SQL 批量插入语句，遇到冲突时更新
+            'values': sql.SQL(
+                'INSERT INTO {table} ({fields}) VALUES %s ON CONFLICT ({conflict}) {action}'
+            ).format(
+                table=table,
+                fields=fields,
+                conflict=conflict,
+                action=action
+            ),
+        }
+        statements = {name: statement.as_string(cursor) for name, statement in statements.items()}
+        statements['values_template'] = values_template
+        return statements
+
+    def _values_upsert(self, data, statements, cursor):
+        """
+        通过 execute_values 分页写入 DataFrame，主键冲突时更新
+        :param data: 已 reset_index 的 pandas DataFrame，包含要插入的数据
+        :param statements: _build_dataframe_statements 构建的 SQL 语句
+        :param cursor: 执行写入使用的游标
+        """
+        # 逐行生成元组交给 execute_values，不构造整张表的 object 列表；
+        # 每页行数按列数折算，单条语句的参数不超过 32767 个
+        values_iter = data.itertuples(index=False, name=None)
+        page_size = max(100, min(10000, 32767 // len(data.columns)))
+        psycopg2.extras.execute_values(
+            cursor, statements['values'], values_iter,
+            template=statements['values_template'], page_size=page_size
         )
 
+    def _copy_upsert(self, data, statements, cursor):
+        """
+        通过 COPY 将 DataFrame 写入临时表，再用一条 INSERT ... SELECT 合并到目标表
+        :param data: 已 reset_index 的 pandas DataFrame，包含要插入的数据
+        :param statements: _build_dataframe_statements 构建的 SQL 语句
+        :param cursor: 执行写入使用的游标
+        """
+        # 处于 with 块开启的外层事务时用保存点包住，COPY 数据出错可以回退后改用其他方式写入
+        nested = not cursor.connection.autocommit
+        if nested:
+            cursor.execute('SAVEPOINT qmt_copy')
         try:
-            psycopg2.extras.execute_values(self.cursor, insert_statement.as_string(self.cursor), values_list)
-            print(f"批量数据已插入到表 {table_name}")
-        except Exception as e:
-            print(f"批量插入数据到表 {table_name} 失败: {e}")
+            # 在事务中执行，使 ON COMMIT DROP 的临时表在整个过程中有效
+            with self._transaction(cursor):
+                cursor.execute(statements['create_staging'])
+
+                # 分块写入 CSV 缓冲区，避免一次性序列化整个 DataFrame
+                for start in range(0, len(data), COPY_CHUNK_ROWS):
+                    buf = io.StringIO()
+                    data.iloc[start:start + COPY_CHUNK_ROWS].to_csv(buf, index=False, header=False, na_rep='\\N')
+                    buf.seek(0)
+                    cursor.copy_expert(statements['copy'], buf)
+
+                cursor.execute(statements['insert_from_staging'])
+
+                # 外层事务提交前临时表不会自动删除，这里提前删掉以便同一事务内再次写入
+                if nested:
+                    cursor.execute(statements['drop_staging'])
+        except psycopg2.DataError:
+            if nested:
+                cursor.execute('ROLLBACK TO SAVEPOINT qmt_copy')
+            raise
+        if nested:
+            cursor.execute('RELEASE SAVEPOINT qmt_copy')
 
     def upsert_from_dict(self, table_name, data):
         """
@@ -220,41 +632,117 @@ class PostgresDB:
         :param data: 字典，包含要插入的数据 {'column1': value1, 'column2': value2, ...}
         """
         if not data:
-            print("未提供任何要插入的数据.")
+            log.warning("未提供任何要插入的数据.")
             return
 
         columns = data.keys()
         values = [data[column] for column in columns]
 
-        # 检查表是否存在，不存在则创建
-        df = pd.DataFrame([data])
-        if not self._get_primary_key(table_name):
-            self._create_table_from_dataframe(table_name, df)
+        with self._cursor() as cursor:
+            # 获取主键列名，表不存在则创建
+            conflict_columns = self._get_table_meta(table_name, cursor)
+            if conflict_columns is None:
+                self._create_table_from_dataframe(table_name, pd.DataFrame([data]), cursor)
+                conflict_columns = self._get_table_meta(table_name, cursor)
+            if not conflict_columns:
+                return
 
-        # 获取主键列名
-        conflict_columns = self._get_primary_key(table_name)
-        if not conflict_columns:
+            try:
+                execute_statement = self._prepared_upsert(table_name, list(columns), conflict_columns, cursor)
+                cursor.execute(execute_statement, values)
+                log.debug("数据已插入到表 %s", table_name)
+            except Exception:
+                log.exception("插入数据到表 %s 失败", table_name)
+                if self._in_transaction:
+                    raise
+
+    def upsert_many(self, table_name, rows):
+        """
+        在一个事务中批量插入多条字典数据，如果主键冲突则更新
+        :param table_name: 表名
+        :param rows: 字典列表，各字典的键需与第一条一致
+        """
+        rows = list(rows)
+        if not rows:
+            log.warning("未提供任何要插入的数据.")
             return
 
+        columns = list(rows[0].keys())
+
+        with self._cursor() as cursor:
+            # 获取主键列名，表不存在则创建
+            conflict_columns = self._get_table_meta(table_name, cursor)
+            if conflict_columns is None:
+                self._create_table_from_dataframe(table_name, pd.DataFrame([rows[0]]), cursor)
+                conflict_columns = self._get_table_meta(table_name, cursor)
+            if not conflict_columns:
+                return
+
+            try:
+                execute_statement = self._prepared_upsert(table_name, columns, conflict_columns, cursor)
+                values_list = [[row[column] for column in columns] for row in rows]
+                with self._transaction(cursor):
+                    cursor.executemany(execute_statement, values_list)
+                log.debug("批量数据已插入到表 %s", table_name)
+            except Exception:
+                log.exception("批量插入数据到表 %s 失败", table_name)
+                if self._in_transaction:
+                    raise
+
+    def _prepared_upsert(self, table_name, columns, conflict_columns, cursor):
+        """
+        获取单行 upsert 的 EXECUTE 语句；首次在某个连接上使用时先 PREPARE，之后同一 (表名, 列) 只需 EXECUTE
+        :param table_name: 表名
+        :param columns: 插入的列
+        :param conflict_columns: 主键列
+        :param cursor: 执行写入使用的游标
+        :return: EXECUTE 语句，参数占位符为 %s
+        """
+        key = ('dict', table_name, tuple(columns))
+        statements = self._stmt_cache.get(key)
+        if statements is None:
+            statements = self._build_prepared_upsert(table_name, columns, conflict_columns, cursor)
+            self._stmt_cache[key] = statements
+
+        name, prepare_statement, execute_statement = statements
+        prepared = PostgresDB._prepared.setdefault(cursor.connection, set())
+        if name not in prepared:
+            cursor.execute(prepare_statement)
+            prepared.add(name)
+        return execute_statement
+
+    def _build_prepared_upsert(self, table_name, columns, conflict_columns, cursor):
+        """
+        构建服务端预备的单行 upsert 语句
+        :param table_name: 表名
+        :param columns: 插入的列
+        :param conflict_columns: 主键列
+        :param cursor: 用于转义标识符的游标
+        :return: (语句名, PREPARE 语句, EXECUTE 语句)，EXECUTE 的参数占位符为 %s
+        """
+        update_columns = [col for col in columns if col not in conflict_columns]
+        # 只有主键列时没有可更新的列，冲突时直接跳过
+        action = sql.SQL('DO UPDATE SET {}').format(sql.SQL(', ').join(
+            sql.Composed([sql.Identifier(col), sql.SQL(' = EXCLUDED.'), sql.Identifier(col)])
+            for col in update_columns
+        )) if update_columns else sql.SQL('DO NOTHING')
+
         # 构建 SQL 插入语句，遇到冲突时更新
         insert_statement = sql.SQL(
-            'INSERT INTO {table} ({fields}) VALUES ({values}) ON CONFLICT ({conflict}) DO UPDATE SET {update_fields}'
+            'INSERT INTO {table} ({fields}) VALUES ({values}) ON CONFLICT ({conflict}) {action}'
         ).format(
             table=sql.Identifier(table_name),
             fields=sql.SQL(',').join(map(sql.Identifier, columns)),
-            values=sql.SQL(',').join(sql.Placeholder() * len(values)),
+            values=sql.SQL(',').join(sql.SQL(f"${i}") for i in range(1, len(columns) + 1)),
             conflict=sql.SQL(', ').join(map(sql.Identifier, conflict_columns)),
-            update_fields=sql.SQL(', ').join(
-                sql.Composed([sql.Identifier(col), sql.SQL(' = EXCLUDED.'), sql.Identifier(col)])
-                for col in columns if col not in conflict_columns
-            )
-        )
+            action=action
+        ).as_string(cursor)
 
-        try:
-            self.cursor.execute(insert_statement, values)
-            print(f"数据已插入到表 {table_name}")
-        except Exception as e:
-            print(f"插入数据到表 {table_name} 失败: {e}")
+        # 语句名由 SQL 文本决定，连接池中的连接被不同实例复用时不会冲突
+        name = f"upsert_{hashlib.md5(insert_statement.encode()).hexdigest()[:16]}"
+        prepare_statement = f"PREPARE {name} AS {insert_statement}"
+        execute_statement = f"EXECUTE {name} ({','.join(['%s'] * len(columns))})"
+        return name, prepare_statement, execute_statement
 
     def upsert(self, table_name, data):
         """
@@ -267,7 +755,7 @@ class PostgresDB:
         elif isinstance(data, dict):
             self.upsert_from_dict(table_name, data)
         else:
-            print("不支持的 upsert 数据类型. 必须是字典或 pandas DataFrame.")
+            log.warning("不支持的 upsert 数据类型. 必须是字典或 pandas DataFrame.")
 
     def save_to_redis(self, key, data):
         """
@@ -276,21 +764,41 @@ class PostgresDB:
         :param data: 要保存的数据字典 {'column1': value1, 'column2': value2, ...}
         """
         if not self.redis_client:
-            print("Redis 未配置.")
+            log.warning("Redis 未配置.")
             return
 
         if not data:
-            print("未提供任何要保存到 Redis 的数据.")
+            log.warning("未提供任何要保存到 Redis 的数据.")
+            return
+
+        self.redis_client.hset(key, mapping=data)
+        log.debug("数据已写入 Redis，键名为 '%s'", key)
+
+    def save_many_to_redis(self, items):
+        """
+        通过 pipeline 一次性将多条数据保存到 Redis 中
+        :param items: {键名: 数据字典}
+        """
+        if not self.redis_client:
+            log.warning("Redis 未配置.")
             return
 
-        self.redis_client.hmset(key, data)
-        print(f"数据已写入 Redis，键名为 '{key}'")
+        items = {key: data for key, data in items.items() if data}
+        if not items:
+            log.warning("未提供任何要保存到 Redis 的数据.")
+            return
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key, data in items.items():
+            pipe.hset(key, mapping=data)
+        pipe.execute()
+        log.debug("%s 条数据已写入 Redis", len(items))
     def is_db_available(self):
         """
         检查数据库实例是否可用
         """
-        if not hasattr(self, 'connection') or not self.connection:
-            print("数据库实例不可用，请检查数据库连接配置.")
+        if getattr(self, '_pool', None) is None or self._pool.closed:
+            log.warning("数据库实例不可用，请检查数据库连接配置.")
             return False
         return True
     def execute(self, command):
@@ -299,11 +807,28 @@ class PostgresDB:
         :param command: PostgreSQL 命令字符串
         """
         try:
-            self.cursor.execute(command)
-            self.connection.commit()
-            print(f"命令 '{command}' 执行成功.")
-        except Exception as e:
-            print(f"命令 '{command}' 执行失败: {e}")
+            with self._cursor() as cursor:
+                cursor.execute(command)
+        except Exception:
+            log.exception("命令 '%s' 执行失败", command)
+            if self._in_transaction:
+                raise
+        finally:
+            self._forget_table_meta(command)
+
+    def _forget_table_meta(self, command):
+        """
+        execute() 之后使表元数据缓存失效，下次写入时重新查询：建表、删表、改表后清空全部缓存，
+        其他命令（如 SELECT ... INTO）也可能新建表，丢弃“表不存在”的记录
+        :param command: 已执行的命令
+        """
+        if SCHEMA_CHANGE_PATTERN.search(command):
+            self.cache = {}
+            self._stmt_cache.clear()
+            return
+        for meta in self.cache.values():
+            if 'primary_key' in meta and meta['primary_key'] is None:
+                del meta['primary_key']
 
     def query(self, query, return_type='pandas'):
         """
@@ -313,27 +838,75 @@ class PostgresDB:
         :return: pandas DataFrame 或 字典
         """
         try:
-            self.cursor.execute(query)
-            columns = [desc[0] for desc in self.cursor.description]
-            rows = self.cursor.fetchall()
+            if return_type not in ('pandas', 'dict'):
+                raise ValueError("无效的返回类型. 使用 'pandas' 或 'dict'.")
+
+            with self._cursor() as cursor:
+                # 服务端游标（DECLARE ... CURSOR）只接受 SELECT/VALUES，其余语句（SHOW、EXPLAIN、
+                # ... RETURNING 等）用普通游标执行；两者都按批 fetchmany 取回结果
+                if self._is_cursor_query(query):
+                    with self._server_cursor(cursor) as stream:
+                        stream.execute(query)
+                        return self._fetch_chunks(stream, return_type)
+                cursor.execute(query)
+                return self._fetch_chunks(cursor, return_type)
+        except Exception:
+            log.exception("查询失败")
+            return None
 
+    @staticmethod
+    def _is_cursor_query(query):
+        """
+        判断语句能否放进服务端游标：SELECT、VALUES、TABLE，以及不含写操作的 WITH 查询
+        """
+        statement = re.sub(r'^(\s|--[^\n]*\n?|/\*.*?\*/|\()*', '', query, flags=re.S)
+        keyword = statement.split(None, 1)[0].upper() if statement else ''
+        if keyword == 'WITH':
+            return not re.search(r'\b(INSERT|UPDATE|DELETE|MERGE)\b', statement, flags=re.I)
+        return keyword in ('SELECT', 'VALUES', 'TABLE')
+
+    @staticmethod
+    def _fetch_chunks(cursor, return_type):
+        """
+        按批取回游标结果，客户端同一时刻只持有一批原始行
+        :param cursor: 已执行查询的游标
+        :param return_type: 返回类型，'pandas' 或 'dict'
+        """
+        chunks = []
+        columns = []
+        while True:
+            # 普通游标上没有结果集的语句（description 为空）直接返回空结果；
+            # 服务端游标要取过一次数据后才有 description
+            if cursor.name is None and cursor.description is None:
+                break
+            rows = cursor.fetchmany(FETCH_CHUNK_ROWS)
+            columns = [desc[0] for desc in cursor.description]
+            if not rows:
+                break
             if return_type == 'pandas':
-                return pd.DataFrame(rows, columns=columns)
-            elif return_type == 'dict':
-                return [dict(zip(columns, row)) for row in rows]
+                chunks.append(pd.DataFrame(rows, columns=columns))
             else:
-                raise ValueError("无效的返回类型. 使用 'pandas' 或 'dict'.")
-        except Exception as e:
-            print(f"查询失败: {e}")
-            return None
+                chunks.extend(dict(zip(columns, row)) for row in rows)
+
+        if return_type == 'pandas':
+            if not chunks:
+                return pd.DataFrame(columns=columns)
+            return pd.concat(chunks, ignore_index=True)
+        return chunks
 
     def close(self):
         """
-        关闭数据库连接
+        关闭数据库连接；连接池由同一配置的实例共享，不随实例关闭
         """
-        self.cursor.close()
-        self.connection.close()
-        print("数据库连接已关闭")
+        with self._compat_lock:
+            if self._compat_cursor is not None:
+                self._compat_cursor.close()
+                self._compat_cursor = None
+            if self._compat_connection is not None:
+                self._compat_connection.close()
+                self._compat_connection = None
+        self.meta.close()
+        log.debug("数据库连接已关闭")
 # 示例使用
 if __name__ == "__main__":
     # 连接到数据库
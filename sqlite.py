@@ -1,116 +1,231 @@
 import sqlite3
 import pandas as pd
 import os
-import pickle
+import re
+import logging
+import threading
+import weakref
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain, islice
+
+try:
+    import connectorx as cx
+except ImportError:  # 未安装 connectorx 时不支持 engine='connectorx'
+    cx = None
+
+log = logging.getLogger(__name__)
+
+# 可能改变表结构的命令，execute() 执行后清空全部表元数据缓存
+SCHEMA_CHANGE_PATTERN = re.compile(r'\b(CREATE|DROP|ALTER)\b', re.I)
+
+# pandas dtype.kind 到列类型的映射，未列出的类型按 TEXT 处理
+SQLITE_TYPES = {
+    'i': 'INTEGER',
+    'u': 'INTEGER',
+    'b': 'INTEGER',
+    'f': 'REAL',
+    'M': 'TEXT',
+    'O': 'TEXT',
+}
+
+# 单条语句可绑定的参数上限，SQLite 3.32 起默认为 32766
+SQLITE_MAX_VARIABLES = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+# 列数不超过该值时用多行 VALUES 写入，更宽的表仍逐行 executemany
+MULTI_VALUES_MAX_COLUMNS = 500
+
+
+@lru_cache(maxsize=None)
+def _quote_ident(name):
+    """
+    将表名或列名加上双引号作为 SQL 标识符，内部的双引号转义，结果按名称缓存
+    :param name: 表名或列名
+    :return: 加引号后的标识符
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class _ThreadConnectionGuard:
+    """
+    存放在线程局部变量中，线程结束时随之回收，触发关闭该线程的连接
+    """
+
+
+def _release_connection(connections, lock, connection):
+    """
+    关闭线程结束后遗留的连接并从连接列表中移除
+    :param connections: SQLiteDB 持有的连接列表
+    :param lock: 保护连接列表的锁
+    :param connection: 要关闭的连接
+    """
+    with lock:
+        try:
+            connections.remove(connection)
+        except ValueError:  # close() 已关闭并清空
+            return
+    connection.close()
 
-import sqlite3
-import pandas as pd
-import os
-import pickle
 
 class SQLiteDB:
     def __init__(self, db_file='sqlite.db'):
         """
         初始化 SQLite 数据库连接
         """
-        # 如果数据库文件不存在，则创建数据库文件
-        if not os.path.exists(db_file):
-            open(db_file, 'w').close()
-
         try:
-            self.cache_file = 'db_cache.pkl'
-            self.cache = self._load_cache()
-            self.connection = sqlite3.connect(db_file)
-            self.cursor = self.connection.cursor()
-        except Exception as e:
-            print(f"SQLite 数据库连接失败: {e}")
+            self.db_file = db_file
+            self._stmt_cache = {}
+            self._indexes = set()
+            # 每个线程使用各自的连接，WAL 模式下读写互不阻塞
+            self._local = threading.local()
+            self._connections = []
+            # 线程结束时的回收可能发生在持锁期间，使用可重入锁
+            self._connections_lock = threading.RLock()
+            self._open_thread_connection()
+            # 已确认存在的表，只保存在内存中
+            self.cache = {}
+        except Exception:
+            log.exception("SQLite 数据库连接失败")
             return
 
-        # 加载缓存
-
+    def _open_thread_connection(self):
+        """
+        为当前线程打开连接并设置 PRAGMA；内存数据库无法跨连接共享，所有线程共用第一个连接
+        """
+        with self._connections_lock:
+            if self.db_file == ':memory:' and self._connections:
+                connection = self._connections[0]
+            else:
+                # 关闭隐式事务，由 begin()/commit() 或 with 块显式控制，多次 upsert 可共用一个事务
+                connection = sqlite3.connect(
+                    self.db_file, isolation_level=None, cached_statements=256, check_same_thread=False
+                )
+                # 页大小只对尚无数据的新库生效，需在切换 WAL 之前设置，已有数据的库会忽略
+                connection.execute("PRAGMA page_size=8192")
+                # WAL 日志 + NORMAL 同步，批量写入时不再每次提交都 fsync，读写互不阻塞
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                connection.execute("PRAGMA temp_store=MEMORY")
+                connection.execute("PRAGMA cache_size=-200000")
+                # 内存映射读取数据库文件，省去页缓存拷贝
+                connection.execute("PRAGMA mmap_size=268435456")
+                self._connections.append(connection)
+                # 每个连接带有较大的页缓存和内存映射，线程结束后立即关闭，不等到 close()
+                guard = _ThreadConnectionGuard()
+                weakref.finalize(guard, _release_connection, self._connections, self._connections_lock, connection)
+                self._local.guard = guard
+        self._local.connection = connection
+        self._local.cursor = connection.cursor()
+        self._local.in_transaction = False
 
-    def _load_cache(self):
+    @property
+    def connection(self):
         """
-        从本地加载缓存
+        当前线程的连接，首次访问时打开
         """
-        if os.path.exists(self.cache_file):
-            with open(self.cache_file, 'rb') as f:
-                return pickle.load(f)
-        return {}
+        if not hasattr(self._local, 'connection'):
+            self._open_thread_connection()
+        return self._local.connection
 
-    def _save_cache(self):
+    @property
+    def cursor(self):
         """
-        保存缓存到本地
+        当前线程的游标
         """
-        with open(self.cache_file, 'wb') as f:
-            pickle.dump(self.cache, f)
+        if not hasattr(self._local, 'cursor'):
+            self._open_thread_connection()
+        return self._local.cursor
+
+    @property
+    def _in_transaction(self):
+        return getattr(self._local, 'in_transaction', False)
+
+    @_in_transaction.setter
+    def _in_transaction(self, value):
+        self._local.in_transaction = value
 
     def clear_cache(self):
         """
         清空缓存
         """
         self.cache = {}
-        self._save_cache()
-        print("缓存已清空")
+        self._stmt_cache.clear()
+        log.info("缓存已清空")
 
-    def _get_primary_key(self, table_name):
+    def _table_exists(self, table_name):
         """
-        获取指定表的主键列名，使用缓存
+        检查表是否存在，存在的结果缓存在内存中，之后不再查询
         :param table_name: 表名
-        :return: 主键列名
+        :return: 表是否存在
         """
-        if table_name in self.cache and 'primary_key' in self.cache[table_name]:
-            return self.cache[table_name]['primary_key']
+        if self.cache.get(table_name, {}).get('exists'):
+            return True
 
-        conflict_column_query = f"PRAGMA table_info({table_name});"
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ? LIMIT 1", (table_name,))
+        if self.cursor.fetchone() is None:
+            return False
 
-        try:
-            self.cursor.execute(conflict_column_query)
-            rows = self.cursor.fetchall()
-            conflict_columns = [row[1] for row in rows if row[5] == 1]  # 第 5 列表示是否为主键
-            # 缓存主键信息
-            if table_name not in self.cache:
-                self.cache[table_name] = {}
-            self.cache[table_name]['primary_key'] = conflict_columns
-            self._save_cache()
-            return conflict_columns
-        except Exception as e:
-            print(f"无法确定主键列: {e}")
+        self._cache_table_meta(table_name, exists=True)
+        return True
+
+    def _cache_table_meta(self, table_name, **meta):
+        """
+        写入表元数据缓存；事务中获得的元数据可能随回滚失效，记下表名，回滚时从缓存中丢弃
+        :param table_name: 表名
+        :param meta: 元数据
+        """
+        self.cache.setdefault(table_name, {}).update(meta)
+        if self._in_transaction:
+            self._local.txn_tables.add(table_name)
+
+    def get_primary_key(self, table_name):
+        """
+        获取指定表的主键列名，按主键中的顺序排列，结果缓存在内存中
+        :param table_name: 表名
+        :return: 主键列名；表不存在时为 None
+        """
+        primary_key = self.cache.get(table_name, {}).get('primary_key')
+        if primary_key is not None:
+            return primary_key
+
+        self.cursor.execute(f"PRAGMA table_info({_quote_ident(table_name)})")
+        rows = self.cursor.fetchall()
+        if not rows:
             return None
 
+        # 第 6 列为该列在主键中的位置，非主键列为 0
+        primary_key = [row[1] for row in sorted(rows, key=lambda row: row[5]) if row[5]]
+        self._cache_table_meta(table_name, exists=True, primary_key=primary_key)
+        return primary_key
+
     def _create_table_from_dataframe(self, table_name, df):
         """
         根据 DataFrame 创建新表
         :param table_name: 表名
         :param df: pandas DataFrame，用于定义表的结构
         """
-        columns_with_types = []
-        for column in df.columns:
-            dtype = df[column].dtype
-            if dtype == 'int64':
-                columns_with_types.append(f"{column} INTEGER")
-            elif dtype == 'float64':
-                columns_with_types.append(f"{column} REAL")
-            else:
-                columns_with_types.append(f"{column} TEXT")
+        columns_with_types = [
+            f"{_quote_ident(column)} {SQLITE_TYPES.get(dtype.kind, 'TEXT')}" for column, dtype in df.dtypes.items()
+        ]
 
         # 使用 DataFrame 的索引作为主键，可能是多字段主键
         primary_keys = [pk for pk in df.index.names if pk is not None]
         if not primary_keys:
-            print("无索引，创建表失败.")
+            log.warning("无索引，创建表失败.")
             return
 
-        primary_keys_str = ', '.join(primary_keys)
+        primary_keys_str = ', '.join(map(_quote_ident, primary_keys))
         for pk in primary_keys:
             if pk not in df.columns:
-                columns_with_types.append(f"{pk} TEXT")
+                columns_with_types.append(f"{_quote_ident(pk)} TEXT")
 
-        create_table_query = f"CREATE TABLE {table_name} ({', '.join(columns_with_types)}, PRIMARY KEY ({primary_keys_str}));"
+        create_table_query = f"CREATE TABLE {_quote_ident(table_name)} ({', '.join(columns_with_types)}, PRIMARY KEY ({primary_keys_str}));"
         try:
             self.cursor.execute(create_table_query)
-            print(f"表 '{table_name}' 创建成功.")
-        except Exception as e:
-            print(f"创建表 '{table_name}' 失败: {e}")
+            log.info("表 '%s' 创建成功.", table_name)
+        except Exception:
+            log.exception("创建表 '%s' 失败", table_name)
+            if self._in_transaction:
+                raise
 
     def upsert_from_dataframe(self, table_name, df):
         """
@@ -119,55 +234,262 @@ class SQLiteDB:
         :param df: pandas DataFrame，包含要插入的数据
         """
         if df.empty:
-            print("未提供任何要插入的数据.")
+            log.warning("未提供任何要插入的数据.")
             return
 
         # 检查表是否存在，不存在则创建
-        if not self._get_primary_key(table_name):
+        if not self._table_exists(table_name):
             self._create_table_from_dataframe(table_name, df)
 
-        columns = df.reset_index().columns.tolist()
-        values_list = df.reset_index().values.tolist()
+        # 只做一次 reset_index，列名和行数据都取自同一个结果
+        flat = df.reset_index()
+        columns = flat.columns.tolist()
+        # 逐行生成元组交给 executemany，不再先物化整个二维列表
+        values_list = flat.itertuples(index=False, name=None)
 
-        # 构建 SQL 批量插入语句，遇到冲突时替换
-        placeholders = ', '.join('?' * len(columns))
-        insert_statement = f"INSERT OR REPLACE INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+        insert_statement = self._insert_statement(table_name, columns)
 
         try:
-            self.cursor.executemany(insert_statement, values_list)
-            self.connection.commit()
-            print(f"批量数据已插入到表 {table_name}")
-        except Exception as e:
-            print(f"批量插入数据到表 {table_name} 失败: {e}")
+            # 整批在一个事务中写入，出错时回滚
+            with self._transaction():
+                if len(df) > 1 and len(columns) <= MULTI_VALUES_MAX_COLUMNS:
+                    self._multi_values_upsert(table_name, columns, values_list)
+                else:
+                    self.cursor.executemany(insert_statement, values_list)
+            log.debug("批量数据已插入到表 %s", table_name)
+        except Exception:
+            log.exception("批量插入数据到表 %s 失败", table_name)
+            if self._in_transaction:
+                raise
+
+    def _multi_values_upsert(self, table_name, columns, rows):
+        """
+        按参数上限分块，每块用一条多行 VALUES 的 INSERT OR REPLACE 写入
+        :param table_name: 表名
+        :param columns: 插入的列
+        :param rows: 行元组的可迭代对象
+        """
+        rows_per_chunk = max(1, SQLITE_MAX_VARIABLES // len(columns))
+        row_placeholders = ', (' + ', '.join(['?'] * len(columns)) + ')'
+        insert_statement = self._insert_statement(table_name, columns)
+
+        # 满块的语句按 (表名, 列) 缓存，最后不足一块的按实际行数拼接
+        key = ('multi', table_name, tuple(columns))
+        chunk_statement = self._stmt_cache.get(key)
+        if chunk_statement is None:
+            chunk_statement = insert_statement + row_placeholders * (rows_per_chunk - 1)
+            self._stmt_cache[key] = chunk_statement
+
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, rows_per_chunk))
+            if not chunk:
+                break
+            if len(chunk) == rows_per_chunk:
+                statement = chunk_statement
+            else:
+                statement = insert_statement + row_placeholders * (len(chunk) - 1)
+            self.cursor.execute(statement, [value for row in chunk for value in row])
+
+    def _insert_statement(self, table_name, columns):
+        """
+        获取 upsert 语句，按 (表名, 列) 缓存
+        :param table_name: 表名
+        :param columns: 插入的列
+        :return: 参数占位符为 ? 的 SQL 语句
+        """
+        key = (table_name, tuple(columns))
+        insert_statement = self._stmt_cache.get(key)
+        if insert_statement is None:
+            # 构建 SQL 插入语句，遇到冲突时替换
+            placeholders = ', '.join(['?'] * len(columns))
+            fields = ', '.join(map(_quote_ident, columns))
+            insert_statement = f"INSERT OR REPLACE INTO {_quote_ident(table_name)} ({fields}) VALUES ({placeholders})"
+            self._stmt_cache[key] = insert_statement
+        return insert_statement
 
     def upsert_from_dict(self, table_name, data):
         """
-        插入数据到指定的表中（从字典），如果主键冲突则更新
+        插入数据到指定的表中（从字典），如果主键冲突则更新。
+        逐行调用时每行单独执行一次，成批数据应使用 upsert_many 或 upsert_many_from_dicts
         :param table_name: 表名
         :param data: 字典，包含要插入的数据 {'column1': value1, 'column2': value2, ...}
         """
         if not data:
-            print("未提供任何要插入的数据.")
+            log.warning("未提供任何要插入的数据.")
             return
 
         columns = list(data.keys())
         values = [data[column] for column in columns]
 
         # 检查表是否存在，不存在则创建
-        df = pd.DataFrame([data])
-        if not self._get_primary_key(table_name):
-            self._create_table_from_dataframe(table_name, df)
+        if not self._table_exists(table_name):
+            self._create_table_from_dataframe(table_name, pd.DataFrame([data]))
 
-        # 构建 SQL 插入语句，遇到冲突时替换
-        placeholders = ', '.join('?' * len(columns))
-        insert_statement = f"INSERT OR REPLACE INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+        insert_statement = self._insert_statement(table_name, columns)
 
         try:
             self.cursor.execute(insert_statement, values)
-            self.connection.commit()
-            print(f"数据已插入到表 {table_name}")
-        except Exception as e:
-            print(f"插入数据到表 {table_name} 失败: {e}")
+            log.debug("数据已插入到表 %s", table_name)
+        except Exception:
+            log.exception("插入数据到表 %s 失败", table_name)
+            if self._in_transaction:
+                raise
+
+    def upsert_many(self, table_name, rows):
+        """
+        在一个事务中批量插入多条字典数据，如果主键冲突则更新
+        :param table_name: 表名
+        :param rows: 字典的可迭代对象，可以是生成器，各字典的键需与第一条一致
+        """
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            log.warning("未提供任何要插入的数据.")
+            return
+
+        columns = list(first.keys())
+        values_list = self._row_iter(chain([first], rows), columns)
+
+        # 检查表是否存在，不存在则创建
+        if not self._table_exists(table_name):
+            self._create_table_from_dataframe(table_name, pd.DataFrame([first]))
+
+        insert_statement = self._insert_statement(table_name, columns)
+
+        try:
+            with self._transaction():
+                self.cursor.executemany(insert_statement, values_list)
+            log.debug("批量数据已插入到表 %s", table_name)
+        except Exception:
+            log.exception("批量插入数据到表 %s 失败", table_name)
+            if self._in_transaction:
+                raise
+
+    def upsert_many_from_dicts(self, table_name, rows):
+        """
+        批量插入键不完全相同的字典数据，按键集合分组，每组一次 executemany，整体在一个事务中写入
+        :param table_name: 表名
+        :param rows: 字典的可迭代对象
+        """
+        groups = {}
+        for row in rows:
+            groups.setdefault(frozenset(row), []).append(row)
+        if not groups:
+            log.warning("未提供任何要插入的数据.")
+            return
+
+        # 检查表是否存在，不存在则创建
+        first = next(iter(groups.values()))[0]
+        if not self._table_exists(table_name):
+            self._create_table_from_dataframe(table_name, pd.DataFrame([first]))
+
+        try:
+            with self._transaction():
+                for group in groups.values():
+                    columns = list(group[0].keys())
+                    insert_statement = self._insert_statement(table_name, columns)
+                    self.cursor.executemany(insert_statement, self._row_iter(group, columns))
+            log.debug("批量数据已插入到表 %s", table_name)
+        except Exception:
+            log.exception("批量插入数据到表 %s 失败", table_name)
+            if self._in_transaction:
+                raise
+
+    def ensure_index(self, table_name, columns, unique=False):
+        """
+        为常用于查询条件的列创建索引，已存在时跳过
+        :param table_name: 表名
+        :param columns: 列名或列名列表，多列时创建复合索引
+        :param unique: 是否创建唯一索引
+        """
+        if isinstance(columns, str):
+            columns = [columns]
+        index_name = f"idx_{table_name}_{'_'.join(columns)}"
+        if index_name in self._indexes:
+            return
+
+        fields = ', '.join(map(_quote_ident, columns))
+        create_index_query = (
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {_quote_ident(index_name)} "
+            f"ON {_quote_ident(table_name)} ({fields})"
+        )
+        try:
+            self.cursor.execute(create_index_query)
+            self._indexes.add(index_name)
+            log.debug("索引 '%s' 已就绪.", index_name)
+        except Exception:
+            log.exception("创建索引 '%s' 失败", index_name)
+            if self._in_transaction:
+                raise
+
+    @staticmethod
+    def _row_iter(rows, columns):
+        """
+        按列顺序逐条生成字典数据的值元组，executemany 边读边写，不物化整批数据
+        :param rows: 字典的可迭代对象
+        :param columns: 列顺序
+        """
+        for row in rows:
+            yield tuple(row[column] for column in columns)
+
+    def begin(self):
+        """
+        开启事务，之后的写入在 commit() 时一并提交
+        """
+        self.cursor.execute('BEGIN IMMEDIATE')
+        self._in_transaction = True
+        # 当前事务中获得元数据的表
+        self._local.txn_tables = set()
+
+    def commit(self):
+        """
+        提交 begin() 开启的事务
+        """
+        self._in_transaction = False
+        self._local.txn_tables = set()
+        self.cursor.execute('COMMIT')
+
+    def rollback(self):
+        """
+        回滚 begin() 开启的事务
+        """
+        self._in_transaction = False
+        for table_name in getattr(self._local, 'txn_tables', ()):
+            self.cache.pop(table_name, None)
+        self._local.txn_tables = set()
+        self.cursor.execute('ROLLBACK')
+
+    @contextmanager
+    def _transaction(self):
+        """
+        在事务中执行；已处于 begin() 或 with 块开启的事务中时直接复用
+        """
+        if self._in_transaction:
+            yield
+            return
+        self.begin()
+        try:
+            yield
+        except Exception:
+            self.rollback()
+            raise
+        self.commit()
+
+    def __enter__(self):
+        """
+        开启事务，with 块内的写入在退出时一并提交；
+        块内的写入失败会抛出异常，整个事务回滚
+        """
+        self.begin()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
 
     def upsert(self, table_name, data):
         """
@@ -180,35 +502,73 @@ class SQLiteDB:
         elif isinstance(data, dict):
             self.upsert_from_dict(table_name, data)
         else:
-            print("不支持的 upsert 数据类型. 必须是字典或 pandas DataFrame.")
+            log.warning("不支持的 upsert 数据类型. 必须是字典或 pandas DataFrame.")
 
-    def query(self, query, return_type='pandas'):
+    def query(self, query, return_type='pandas', engine=None, chunksize=None):
         """
         查询数据并返回 pandas DataFrame 或字典格式
         :param query: SQL 查询语句
         :param return_type: 返回类型，'pandas' 返回 DataFrame，'dict' 返回字典
+        :param engine: 为 'connectorx' 时由 connectorx 直接按列构建 DataFrame，
+                       使用独立连接，读不到当前未提交事务中的写入
+        :param chunksize: 指定时返回生成器，每次产出至多 chunksize 行的 DataFrame 或字典列表
         :return: pandas DataFrame 或 字典
         """
         try:
+            if return_type not in ('pandas', 'dict'):
+                raise ValueError("无效的返回类型. 使用 'pandas' 或 'dict'.")
+            if chunksize:
+                if engine == 'connectorx':
+                    raise ValueError("chunksize 不支持 engine='connectorx'.")
+                # 语句在这里执行，出错时与其他方式一样记录日志并返回 None，而不是等到调用方取第一块时才抛出
+                cursor = self.connection.cursor()
+                try:
+                    cursor.execute(query)
+                except Exception:
+                    cursor.close()
+                    raise
+                return self._iter_query(cursor, return_type, chunksize)
+
+            if return_type == 'pandas':
+                if engine == 'connectorx':
+                    if cx is None:
+                        raise ImportError("engine='connectorx' 需要安装 connectorx.")
+                    return cx.read_sql(f"sqlite://{os.path.abspath(self.db_file)}", query)
+                return pd.read_sql_query(query, self.connection)
+
             self.cursor.execute(query)
             columns = [desc[0] for desc in self.cursor.description]
             rows = self.cursor.fetchall()
-
-            if return_type == 'pandas':
-                return pd.DataFrame(rows, columns=columns)
-            elif return_type == 'dict':
-                return [dict(zip(columns, row)) for row in rows]
-            else:
-                raise ValueError("无效的返回类型. 使用 'pandas' 或 'dict'.")
-        except Exception as e:
-            print(f"查询失败: {e}")
+            return [dict(zip(columns, row)) for row in rows]
+        except Exception:
+            log.exception("查询失败")
             return None
+
+    def _iter_query(self, cursor, return_type, chunksize):
+        """
+        分块读取查询结果，逐块 fetchmany，内存只保留当前块，读完后关闭游标
+        :param cursor: 已执行查询的独立游标
+        :param return_type: 返回类型，'pandas' 或 'dict'
+        :param chunksize: 每块行数
+        """
+        try:
+            columns = [desc[0] for desc in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                if return_type == 'pandas':
+                    yield pd.DataFrame(rows, columns=columns)
+                else:
+                    yield [dict(zip(columns, row)) for row in rows]
+        finally:
+            cursor.close()
     def is_db_available(self):
         """
         检查数据库实例是否可用
         """
         if not hasattr(self, 'connection') or not self.connection:
-            print("数据库实例不可用，请检查数据库连接配置.")
+            log.warning("数据库实例不可用，请检查数据库连接配置.")
             return False
         return True
     def execute(self, command):
@@ -218,17 +578,27 @@ class SQLiteDB:
         """
         try:
             self.cursor.execute(command)
-            self.connection.commit()
-            print(f"命令 '{command}' 执行成功.")
-        except Exception as e:
-            print(f"命令 '{command}' 执行失败: {e}")
+        except Exception:
+            log.exception("命令 '%s' 执行失败", command)
+            if self._in_transaction:
+                raise
+        finally:
+            # 建表、删表、改表后已缓存的表和索引信息可能失效，清空后下次写入时重新查询
+            if SCHEMA_CHANGE_PATTERN.search(command):
+                self.cache = {}
+                self._stmt_cache.clear()
+                self._indexes.clear()
     def close(self):
         """
-        关闭数据库连接
+        关闭数据库连接，包括各线程打开的连接
         """
-        self.cursor.close()
-        self.connection.close()
-        print("数据库连接已关闭")
+        with self._connections_lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+        log.debug("数据库连接已关闭")
 # 示例使用
 if __name__ == "__main__":
     # 连接到 SQLite 数据库